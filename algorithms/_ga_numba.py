@@ -0,0 +1,36 @@
+"""
+Numba kernels for the GA bit operators in algorithms.genetic.
+
+numba is optional: without it these run as plain NumPy/Python (same results,
+no compilation). With it they are jit-compiled on first call and cached on disk.
+Note that jitted code draws from numba's own per-thread RNG; seed() only seeds
+it for the calling thread.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # pragma: no cover - numba not installed
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True)
+def seed(value):
+    np.random.seed(value)
+
+
+@njit(cache=True)
+def crossover(a, b, pt):
+    return np.concatenate((a[:pt], b[pt:])), np.concatenate((b[:pt], a[pt:]))
+
+
+@njit(cache=True)
+def mutate_inplace(g, num, prob):
+    for _ in range(num):
+        index = np.random.randint(0, g.size)
+        if np.random.random() <= prob:
+            g[index] ^= 1
+    return g
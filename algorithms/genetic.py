@@ -1,7 +1,12 @@
-from random import choices, randint, randrange, random, sample
+import random as _random
+from random import randint, sample
 from typing import List, Optional, Callable, Tuple
 
-Genome = List[int]
+import numpy as np
+
+from algorithms import _ga_numba
+
+Genome = np.ndarray  # 1-D uint8 array of 0/1 bits
 Population = List[Genome]
 PopulateFunc = Callable[[], Population]
 FitnessFunc = Callable[[Genome], int]
@@ -11,12 +16,19 @@ MutationFunc = Callable[[Genome], Genome]
 PrinterFunc = Callable[[Population, int, FitnessFunc], None]
 
 
+def _random_bits(count: int) -> np.ndarray:
+    # one getrandbits draw (seedable with random.seed, unlike os.urandom), unpacked to 0/1 uint8
+    num_bytes = (count + 7) // 8
+    packed = _random.getrandbits(num_bytes * 8).to_bytes(num_bytes, "little")
+    return np.unpackbits(np.frombuffer(packed, dtype=np.uint8))[:count]
+
+
 def generate_genome(length: int) -> Genome:
-    return choices([0, 1], k=length)
+    return _random_bits(length)
 
 
 def generate_population(size: int, genome_length: int) -> Population:
-    return [generate_genome(genome_length) for _ in range(size)]
+    return list(_random_bits(size * genome_length).reshape(size, genome_length))
 
 
 def single_point_crossover(a: Genome, b: Genome) -> Tuple[Genome, Genome]:
@@ -28,14 +40,11 @@ def single_point_crossover(a: Genome, b: Genome) -> Tuple[Genome, Genome]:
         return a, b
 
     p = randint(1, length - 1)
-    return a[0:p] + b[p:], b[0:p] + a[p:]
+    return _ga_numba.crossover(a, b, p)
 
 
 def mutation(genome: Genome, num: int = 1, probability: float = 0.5) -> Genome:
-    for _ in range(num):
-        index = randrange(len(genome))
-        genome[index] = genome[index] if random() > probability else abs(genome[index] - 1)
-    return genome
+    return _ga_numba.mutate_inplace(genome, num, probability)
 
 
 def population_fitness(population: Population, fitness_func: FitnessFunc) -> int:
@@ -103,14 +112,16 @@ def run_evolution(
         if fitness_func(population[0]) >= fitness_limit:
             break
 
-        next_generation = population[0:2]
+        next_generation = [None] * (2 * (len(population) // 2))
+        next_generation[0:2] = population[0:2]
 
+        idx = 2
         for j in range(int(len(population) / 2) - 1):
             parents = selection_func(population, fitness_func)
             offspring_a, offspring_b = crossover_func(parents[0], parents[1])
-            offspring_a = mutation_func(offspring_a)
-            offspring_b = mutation_func(offspring_b)
-            next_generation += [offspring_a, offspring_b]
+            next_generation[idx] = mutation_func(offspring_a)
+            next_generation[idx + 1] = mutation_func(offspring_b)
+            idx += 2
 
         population = next_generation
 
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import tempfile, os, time, uuid
+from pydantic import BaseModel, Field
+from collections import OrderedDict
+import asyncio
+import uuid
 from pathlib import Path
 import sys
 import traceback
@@ -26,7 +28,45 @@ app.add_middleware(
 )
 
 # --- In-memory session store (fine for local dev) ---
-SESSIONS = {}  # session_id -> dict(state)
+# Least recently used sessions are evicted once MAX_SESSIONS is exceeded.
+MAX_SESSIONS = 100
+# Candidates rendered ahead of time per session, so /rate can answer immediately.
+PREFETCH_DEPTH = 3
+SESSIONS: "OrderedDict[str, dict]" = OrderedDict()  # session_id -> dict(state)
+
+
+def midi_response(midi: bytes, session_id: str, candidate_id: str, sess: dict) -> Response:
+    # per-session counter; only names the download (the frontend picks its own file name)
+    sess["counter"] += 1
+    filename = f"cand_{sess['counter']:06d}.mid"
+    return Response(
+        content=midi,
+        media_type="audio/midi",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Session-Id": session_id,
+            "X-Candidate-Id": candidate_id,
+        },
+    )
+
+
+async def generate_in_thread(sess: dict, steps: int):
+    """
+    Generate the next candidate for `sess` without blocking the event loop;
+    caller holds sess["lock"]. The state stays in this process, a step is well under 1ms.
+    """
+    candidate_id, midi = await asyncio.to_thread(mgen.generate_next_candidate, sess["state"], steps=steps)
+    sess["last_candidate_id"] = candidate_id
+    return candidate_id, midi
+
+
+async def prefetch(sess: dict):
+    """Background task: render the next candidates while the user listens to this one."""
+    async with sess["lock"]:
+        await asyncio.to_thread(
+            mgen.prefetch_candidates, sess["state"], PREFETCH_DEPTH, steps=sess["params"]["steps"]
+        )
+
 
 class GenerateRequest(BaseModel):
     key: str = "C"
@@ -34,7 +74,7 @@ class GenerateRequest(BaseModel):
     bars: int = 8
     notes_per_bar: int = 4
     steps: int = 1
-    tempo: int = 120
+    tempo: int = Field(120, gt=0)
     generations: int = 50  # UI-only for now
     population: int = 60
     pauses: bool = True
@@ -51,16 +91,13 @@ def health():
 
 
 @app.post("/generate")
-def generate(req: GenerateRequest):
+async def generate(req: GenerateRequest, background_tasks: BackgroundTasks):
     """
     Generates ONE candidate MIDI for a NEW session.
     Returns the MIDI file directly, with headers containing session_id + candidate_id.
     """
     try:
         session_id = str(uuid.uuid4())
-        out_dir = tempfile.mkdtemp(prefix="musicga_")
-        ts = int(time.time())
-        out_path = os.path.join(out_dir, f"cand_{ts}.mid")
 
         # Create a new GA session state
         state = mgen.init_session_state(
@@ -75,20 +112,24 @@ def generate(req: GenerateRequest):
             mutation_prob=0.5,
         )
 
-        # Generate first candidate
-        candidate_id = mgen.generate_next_candidate(state, out_path=out_path, steps=req.steps)
-
-        SESSIONS[session_id] = {
+        sess = {
             "state": state,
-            "last_candidate_id": candidate_id,
-            "out_dir": out_dir,
+            "last_candidate_id": None,
             "params": req.model_dump(),
+            "counter": 0,
+            "lock": asyncio.Lock(),  # one GA step at a time per session
         }
 
-        resp = FileResponse(out_path, media_type="audio/midi", filename="generated.mid")
-        resp.headers["X-Session-Id"] = session_id
-        resp.headers["X-Candidate-Id"] = candidate_id
-        return resp
+        # Generate first candidate
+        async with sess["lock"]:
+            candidate_id, midi = await generate_in_thread(sess, req.steps)
+
+        SESSIONS[session_id] = sess
+        while len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+        background_tasks.add_task(prefetch, sess)
+
+        return midi_response(midi, session_id, candidate_id, sess)
 
     except Exception as e:
         # dev-friendly error; you can remove traceback later
@@ -97,7 +138,7 @@ def generate(req: GenerateRequest):
 
 
 @app.post("/rate")
-def rate(req: RateRequest):
+async def rate(req: RateRequest, background_tasks: BackgroundTasks):
     """
     Submit a rating for the current candidate, then returns NEXT candidate MIDI.
     """
@@ -108,30 +149,25 @@ def rate(req: RateRequest):
         if not (0 <= req.rating <= 5):
             raise HTTPException(status_code=400, detail="rating must be 0..5")
 
+        SESSIONS.move_to_end(req.session_id)
         sess = SESSIONS[req.session_id]
-        state = sess["state"]
         params = sess["params"]
 
-        # Store rating + evolve state internally
-        mgen.submit_rating(state, candidate_id=req.candidate_id, rating=req.rating)
-
-        # Generate next candidate
-        out_dir = sess["out_dir"]
-        ts = int(time.time())
-        out_path = os.path.join(out_dir, f"cand_{ts}.mid")
+        async with sess["lock"]:
+            # Store rating + evolve state internally
+            mgen.submit_rating(sess["state"], candidate_id=req.candidate_id, rating=req.rating)
 
-        candidate_id = mgen.generate_next_candidate(
-            state,
-            out_path=out_path,
-            steps=params["steps"],
-        )
+            # Serve a prefetched candidate, or generate one if none is ready yet
+            prefetched = mgen.pop_prefetched_candidate(sess["state"])
+            if prefetched is not None:
+                candidate_id, midi = prefetched
+                sess["last_candidate_id"] = candidate_id
+            else:
+                candidate_id, midi = await generate_in_thread(sess, params["steps"])
 
-        sess["last_candidate_id"] = candidate_id
+        background_tasks.add_task(prefetch, sess)
 
-        resp = FileResponse(out_path, media_type="audio/midi", filename="generated.mid")
-        resp.headers["X-Session-Id"] = req.session_id
-        resp.headers["X-Candidate-Id"] = candidate_id
-        return resp
+        return midi_response(midi, req.session_id, candidate_id, sess)
 
     except HTTPException:
         raise
@@ -1,15 +1,20 @@
 import click
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 import os
 import random
-from typing import List, Dict, Any, Callable
+import struct
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+
+import numpy as np
 
 # music21
 from music21 import stream, note, scale as m21scale, instrument, tempo
 
 # GA helpers
 from algorithms.genetic import (
-    generate_genome,
+    generate_population,
     Genome,
     selection_pair,
     single_point_crossover,
@@ -17,18 +22,29 @@ from algorithms.genetic import (
 )
 
 BITS_PER_NOTE = 4
+# highest note bit: set means rest (when pauses are allowed)
+_MASK = 1 << (BITS_PER_NOTE - 1)
+# little-endian place values of the bits in one note chunk
+_BIT_WEIGHTS = (1 << np.arange(BITS_PER_NOTE)).astype(np.uint8)
 KEYS = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
 SCALES = ["major", "minor", "dorian", "phrygian", "lydian", "mixolydian", "majorBlues", "minorBlues"]
 
+# tonic pitches parsed once, instead of note.Note(key).pitch per scale build
+_KEY_PITCHES = {k: note.Note(k).pitch for k in KEYS}
+
+# resolution of the MIDI files written by _midi_bytes
+TICKS_PER_QUARTER = 480
 
-def int_from_bits(bits: List[int]) -> int:
-    """Convert a list of bits to an integer."""
-    return int(sum([bit * pow(2, index) for index, bit in enumerate(bits)]))
+# (key, scale_name) -> midi values of the scale pitches, filled on first use
+_SCALE_MIDI_CACHE: Dict[Tuple[str, str], Tuple[int, ...]] = {}
 
 
+@lru_cache(maxsize=None)
 def _build_scale(key: str, scale_name: str):
-    """Return a music21 scale object from (key, scale_name)."""
-    key_pitch = note.Note(key).pitch
+    """Return a music21 scale object from (key, scale_name). Cached, treat as read-only."""
+    key_pitch = _KEY_PITCHES.get(key)
+    if key_pitch is None:
+        key_pitch = note.Note(key).pitch
 
     if scale_name == "major":
         sc = m21scale.MajorScale(key_pitch)
@@ -56,6 +72,23 @@ def _build_scale(key: str, scale_name: str):
     return sc
 
 
+def _scale_midis(key: str, scale_name: str) -> Tuple[int, ...]:
+    """Return the midi values of the scale pitches for (key, scale_name)."""
+    cache_key = (key, scale_name)
+    midis = _SCALE_MIDI_CACHE.get(cache_key)
+    if midis is None:
+        midis = tuple(p.midi for p in _build_scale(key, scale_name).getPitches())
+        _SCALE_MIDI_CACHE[cache_key] = midis
+    return midis
+
+
+class Melody(NamedTuple):
+    """Immutable genome_to_melody result (safe to share from the cache)."""
+    notes: Tuple[Tuple[int, ...], ...]  # per step: midi values (0 = rest)
+    velocity: Tuple[int, ...]
+    beat: Tuple[float, ...]  # quarterLength
+
+
 def genome_to_melody(
     genome: Genome,
     num_bars: int,
@@ -65,58 +98,72 @@ def genome_to_melody(
     key: str,
     scale_name: str,
     root: int,
-) -> Dict[str, list]:
+    scale_midis: Optional[np.ndarray] = None,
+) -> Melody:
     """
     Convert a genome to a melody representation.
-    melody["notes"] becomes a list of steps, each step is a list of midi values (0 = rest).
+    melody.notes is a tuple of steps, each step is a tuple of midi values (0 = rest).
+    scale_midis (see init_session_state) skips the scale lookup for (key, scale_name).
+    Results are memoized on the genome bits and the scale table.
     """
-    chunks = [
-        genome[i * BITS_PER_NOTE : i * BITS_PER_NOTE + BITS_PER_NOTE]
-        for i in range(num_bars * num_notes)
-    ]
+    if scale_midis is None:
+        scale_midis = np.array(_scale_midis(key, scale_name), dtype=np.int16)
+
+    return _melody_from_bits(
+        np.asarray(genome, dtype=np.uint8).tobytes(),
+        num_bars,
+        num_notes,
+        num_steps,
+        pauses,
+        scale_midis.astype(np.int16).tobytes(),
+    )
 
-    note_length = 4 / float(num_notes)  # quarterLength
 
-    sc = _build_scale(key, scale_name)
-    scale_pitches = sc.getPitches()
-    if not scale_pitches:
-        scale_pitches = m21scale.MajorScale(note.Note(key).pitch).getPitches()
+# Small on purpose: hits come from decoding the same genome again shortly after,
+# e.g. the CLI previews a population in fitness() and then saves it, and
+# generate_next_candidate(out_path=...) saves and renders the same child.
+@lru_cache(maxsize=64)
+def _melody_from_bits(
+    genome_bits: bytes,
+    num_bars: int,
+    num_notes: int,
+    num_steps: int,
+    pauses: bool,
+    scale_table: bytes,
+) -> Melody:
+    scale_midis = np.frombuffer(scale_table, dtype=np.int16)
+
+    # decode every 4-bit chunk (little-endian) to an integer in one pass
+    num_chunks = num_bars * num_notes
+    bits = np.frombuffer(genome_bits, dtype=np.uint8)[: num_chunks * BITS_PER_NOTE]
+    integers = bits.reshape(num_chunks, BITS_PER_NOTE).dot(_BIT_WEIGHTS)
 
-    melody = {"notes": [], "velocity": [], "beat": []}
+    if not pauses:
+        integers = integers & (_MASK - 1)
 
-    for note_bits in chunks:
-        integer = int_from_bits(note_bits)
+    note_length = 4 / float(num_notes)  # quarterLength
 
-        if not pauses:
-            integer = int(integer % pow(2, BITS_PER_NOTE - 1))
+    # rest if highest bit set; rests are stored as degree 0
+    is_rest = integers >= _MASK
+    values = np.where(is_rest, 0, integers).astype(np.int16)
 
-        # rest if highest bit set
-        if integer >= pow(2, BITS_PER_NOTE - 1):
-            melody["notes"].append(0)
-            melody["velocity"].append(0)
-            melody["beat"].append(note_length)
-        else:
-            # extend same note
-            if len(melody["notes"]) > 0 and melody["notes"][-1] == integer:
-                melody["beat"][-1] += note_length
-            else:
-                melody["notes"].append(integer)
-                melody["velocity"].append(127)
-                melody["beat"].append(note_length)
+    # a new note starts on every rest and wherever the value changes;
+    # otherwise the previous note is extended
+    starts = np.flatnonzero(is_rest | (np.diff(values, prepend=-1) != 0))
+    run_lengths = np.diff(np.append(starts, values.size))
+
+    degrees = values[starts]
 
     steps = []
     for step in range(num_steps):
-        step_notes = []
-        for v in melody["notes"]:
-            if v == 0:
-                step_notes.append(0)
-            else:
-                idx = (v + step * 2) % len(scale_pitches)
-                step_notes.append(scale_pitches[idx].midi)
-        steps.append(step_notes)
+        step_notes = np.take(scale_midis, degrees + step * 2, mode="wrap")
+        steps.append(tuple(np.where(degrees == 0, 0, step_notes).tolist()))
 
-    melody["notes"] = steps
-    return melody
+    return Melody(
+        notes=tuple(steps),
+        velocity=tuple(np.where(is_rest[starts], 0, 127).tolist()),
+        beat=tuple((run_lengths * note_length).tolist()),
+    )
 
 
 def genome_to_stream(
@@ -135,30 +182,82 @@ def genome_to_stream(
 
     streams: List[stream.Stream] = []
 
-    for step_notes in melody["notes"]:
+    for step_notes in melody.notes:
         s = stream.Stream()
         s.append(tempo.MetronomeMark(number=bpm))
         s.append(instrument.Piano())
 
-        current_offset = 0.0
+        # notes are consecutive, so append (no explicit offsets) is enough
         for i, midi_val in enumerate(step_notes):
-            dur = melody["beat"][i]
+            dur = melody.beat[i]
             if midi_val == 0:
                 n = note.Rest()
                 n.quarterLength = dur
             else:
                 n = note.Note(midi_val)
-                n.volume.velocity = melody["velocity"][i]
+                n.volume.velocity = melody.velocity[i]
                 n.quarterLength = dur
 
-            s.insert(current_offset, n)
-            current_offset += dur
+            s.append(n)
 
         streams.append(s)
 
     return streams
 
 
+def _var_len(value: int) -> bytes:
+    """Encode a non-negative int as a MIDI variable-length quantity."""
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def _midi_bytes(
+    midi_vals: Tuple[int, ...], durations: Tuple[float, ...], velocities: Tuple[int, ...], bpm: int
+) -> bytes:
+    """
+    Build a single-track (format 0) standard MIDI file for one melody step.
+    midi_vals of 0 are rests; durations are in quarterLength.
+    """
+    track = bytearray()
+    # tempo (microseconds per quarter, clamped to the 24-bit field) + piano program on channel 0
+    us_per_quarter = min(max(60_000_000 // max(bpm, 1), 1), 0xFFFFFF)
+    track += b"\x00\xff\x51\x03" + us_per_quarter.to_bytes(3, "big")
+    track += b"\x00\xc0\x00"
+
+    delta = 0
+    for midi_val, dur, vel in zip(midi_vals, durations, velocities):
+        ticks = int(round(dur * TICKS_PER_QUARTER))
+        if midi_val == 0:
+            delta += ticks
+            continue
+        track += _var_len(delta) + bytes((0x90, midi_val, vel))
+        track += _var_len(ticks) + bytes((0x80, midi_val, 0))
+        delta = 0
+
+    # end of track (after any trailing rest)
+    track += _var_len(delta) + b"\xff\x2f\x00"
+
+    header = b"MThd" + struct.pack(">IHHH", 6, 0, 1, TICKS_PER_QUARTER)
+    return header + b"MTrk" + struct.pack(">I", len(track)) + bytes(track)
+
+
+def _write_midi_fast(
+    out_path: str,
+    midi_vals: Tuple[int, ...],
+    durations: Tuple[float, ...],
+    velocities: Tuple[int, ...],
+    bpm: int,
+):
+    """Write one melody step straight to a MIDI file, without building music21 objects."""
+    data = _midi_bytes(midi_vals, durations, velocities, bpm)
+    with open(out_path, "wb") as f:
+        f.write(data)
+
+
 def save_genome_to_midi(
     filename: str,
     genome: Genome,
@@ -170,6 +269,7 @@ def save_genome_to_midi(
     scale_name: str,
     root: int,
     bpm: int,
+    scale_midis: Optional[np.ndarray] = None,
 ):
     """
     Save genome as MIDI.
@@ -177,8 +277,14 @@ def save_genome_to_midi(
       - step0 saved to `filename`
       - step1.. saved to `<base>_step{i}.mid`
     """
-    streams = genome_to_stream(genome, num_bars, num_notes, num_steps, pauses, key, scale_name, root, bpm)
+    melody = genome_to_melody(
+        genome, num_bars, num_notes, num_steps, pauses, key, scale_name, root, scale_midis=scale_midis
+    )
+    _save_melody_to_midi(filename, melody, bpm)
+
 
+def _save_melody_to_midi(filename: str, melody: Melody, bpm: int):
+    """Write every step of a genome_to_melody result, named as in save_genome_to_midi."""
     parent = os.path.dirname(filename)
     if parent:
         os.makedirs(parent, exist_ok=True)
@@ -187,12 +293,17 @@ def save_genome_to_midi(
     if ext.lower() != ".mid":
         ext = ".mid"
 
-    for i, s in enumerate(streams):
+    for i, step_notes in enumerate(melody.notes):
         if i == 0:
             out = base + ext
         else:
             out = f"{base}_step{i}{ext}"
-        s.write("midi", fp=out)
+        _write_midi_fast(out, step_notes, melody.beat, melody.velocity, bpm)
+
+
+def _genome_key(genome: Genome) -> bytes:
+    """Hashable key identifying a genome by its bits."""
+    return np.asarray(genome, dtype=np.uint8).tobytes()
 
 
 # =========================================================
@@ -252,7 +363,7 @@ def main(
     """Original interactive GA loop (CLI)."""
     folder = str(int(datetime.now().timestamp()))
     genome_length = num_bars * num_notes * BITS_PER_NOTE
-    population = [generate_genome(genome_length) for _ in range(population_size)]
+    population = generate_population(population_size, genome_length)
     population_id = 0
 
     running = True
@@ -267,20 +378,22 @@ def main(
         population = [x[0] for x in pop_fit_sorted]
 
         # fitness lookup required by selection_pair
+        pop_fit_map = {_genome_key(g): f for g, f in pop_fit}
+
         def fitness_lookup(genome: Genome) -> int:
-            for g, f in pop_fit:
-                if g == genome:
-                    return f
-            return 0
+            return pop_fit_map.get(_genome_key(genome), 0)
 
-        next_generation = population[0:2]  # elite
+        # elite pair + offspring pairs, filled in place (an odd size drops one, as before)
+        next_generation = [None] * (2 * (len(population) // 2))
+        next_generation[0:2] = population[0:2]  # elite
 
+        idx = 2
         for _ in range(int(len(population) / 2) - 1):
             parents = selection_pair(population, fitness_lookup)
             a, b = single_point_crossover(parents[0], parents[1])
-            a = mutation(a, num=num_mutations, probability=mutation_probability)
-            b = mutation(b, num=num_mutations, probability=mutation_probability)
-            next_generation += [a, b]
+            next_generation[idx] = mutation(a, num=num_mutations, probability=mutation_probability)
+            next_generation[idx + 1] = mutation(b, num=num_mutations, probability=mutation_probability)
+            idx += 2
 
         print(f"Population {population_id} done")
 
@@ -321,7 +434,7 @@ def init_session_state(
     mutation_prob: float,
 ) -> Dict[str, Any]:
     genome_length = num_bars * num_notes * BITS_PER_NOTE
-    population = [generate_genome(genome_length) for _ in range(population_size)]
+    population = generate_population(population_size, genome_length)
     return {
         "num_bars": num_bars,
         "num_notes": num_notes,
@@ -333,42 +446,35 @@ def init_session_state(
         "num_mutations": num_mutations,
         "mutation_prob": mutation_prob,
         "population": population,
-        "ratings": [],            # list of (genome, rating)
+        # key/scale are fixed per session, so resolve scale degrees -> midi once
+        "scale_midis": np.array(_scale_midis(key, scale), dtype=np.int16),
+        "ratings_map": {},        # genome key -> latest rating
         "last_genome": None,
         "last_candidate_id": None,
         "generation": 0,
+        "prefetch_queue": deque(),  # (candidate_id, genome, midi) ready to serve
     }
 
 
-def _fitness_lookup_from_ratings(state: Dict[str, Any]) -> Callable[[Genome], int]:
-    """
-    selection_pair requires fitness_func(genome) -> int.
-    We'll use ratings gathered so far; unrated genomes get 0.
-    """
-    def fitness_func(genome: Genome) -> int:
-        # look for exact match genome object equality
-        for g, r in state["ratings"]:
-            if g == genome:
-                return int(r)
-        return 0
-    return fitness_func
-
-
-def generate_next_candidate(state: Dict[str, Any], out_path: str, steps: int = 1) -> str:
+def evolve_child(state: Dict[str, Any]) -> Tuple[Genome, str]:
     """
-    Produce ONE candidate genome based on current population and existing ratings.
-    Save MIDI to out_path and return candidate_id.
+    Breed ONE child from the current population and existing ratings and put it
+    into the population. Return (child, candidate_id); nothing is rendered or served.
     """
     state["generation"] += 1
 
-    fitness_func = _fitness_lookup_from_ratings(state)
-
-    # pick parents with current ratings (or random if no ratings yet)
-    try:
-        parents = selection_pair(state["population"], fitness_func)
-    except TypeError:
-        # if their selection_pair signature differs, fallback to random
-        parents = random.sample(state["population"], 2)
+    # pick parents weighted by rating + 1 (unrated genomes count as 0). Like
+    # selection_pair's sample() over the weighted list, the second draw has one
+    # copy of the first parent removed, so with no ratings a genome is never
+    # paired with itself.
+    population = state["population"]
+    ratings_map = state["ratings_map"]
+    weights = [ratings_map.get(_genome_key(g), 0) + 1 for g in population]
+    indices = range(len(population))
+    first = random.choices(indices, weights=weights)[0]
+    weights[first] -= 1
+    second = random.choices(indices, weights=weights)[0] if any(weights) else first
+    parents = population[first], population[second]
 
     try:
         child_a, child_b = single_point_crossover(parents[0], parents[1])
@@ -383,13 +489,12 @@ def generate_next_candidate(state: Dict[str, Any], out_path: str, steps: int = 1
     replace_idx = random.randrange(len(state["population"]))
     state["population"][replace_idx] = child
 
-    state["last_genome"] = child
-
     candidate_id = f"g{state['generation']}_{random.randint(100000, 999999)}"
-    state["last_candidate_id"] = candidate_id
+    return child, candidate_id
 
-    save_genome_to_midi(
-        out_path,
+
+def _candidate_melody(state: Dict[str, Any], child: Genome, steps: int) -> Melody:
+    return genome_to_melody(
         child,
         num_bars=state["num_bars"],
         num_notes=state["num_notes"],
@@ -398,10 +503,34 @@ def generate_next_candidate(state: Dict[str, Any], out_path: str, steps: int = 1
         key=state["key"],
         scale_name=state["scale"],
         root=0,
-        bpm=state["bpm"],
+        scale_midis=state["scale_midis"],
     )
 
-    return candidate_id
+
+def render_candidate(state: Dict[str, Any], child: Genome, steps: int = 1) -> bytes:
+    """Return the MIDI bytes of the child's first step."""
+    melody = _candidate_melody(state, child, steps)
+    return _midi_bytes(melody.notes[0], melody.beat, melody.velocity, state["bpm"])
+
+
+def generate_next_candidate(
+    state: Dict[str, Any], out_path: Optional[str] = None, steps: int = 1
+) -> Tuple[str, bytes]:
+    """
+    Produce ONE candidate genome based on current population and existing ratings,
+    and make it the one the next rating applies to.
+    Return (candidate_id, MIDI bytes of the first step); if out_path is given,
+    every step is also saved there as in save_genome_to_midi.
+    """
+    child, candidate_id = evolve_child(state)
+
+    state["last_genome"] = child
+    state["last_candidate_id"] = candidate_id
+
+    if out_path is not None:
+        _save_melody_to_midi(out_path, _candidate_melody(state, child, steps), state["bpm"])
+
+    return candidate_id, render_candidate(state, child, steps)
 
 
 def submit_rating(state: Dict[str, Any], candidate_id: str, rating: int):
@@ -413,7 +542,7 @@ def submit_rating(state: Dict[str, Any], candidate_id: str, rating: int):
         return
 
     # attach rating to the last genome (simple but effective)
-    state["ratings"].append((state["last_genome"], rating))
+    state["ratings_map"][_genome_key(state["last_genome"])] = rating
 
     # If rating is high, also "elite-keep" it in population
     if rating >= 4:
@@ -421,6 +550,29 @@ def submit_rating(state: Dict[str, Any], candidate_id: str, rating: int):
         state["population"][idx] = state["last_genome"]
 
 
+def prefetch_candidates(state: Dict[str, Any], depth: int, steps: int = 1):
+    """
+    Top up state["prefetch_queue"] to `depth` rendered candidates.
+    They are not served yet, so last_genome / last_candidate_id are left as they are.
+    """
+    while len(state["prefetch_queue"]) < depth:
+        child, candidate_id = evolve_child(state)
+        state["prefetch_queue"].append((candidate_id, child, render_candidate(state, child, steps)))
+
+
+def pop_prefetched_candidate(state: Dict[str, Any]) -> Optional[Tuple[str, bytes]]:
+    """
+    Serve the oldest prefetched candidate, making it the one the next rating applies to.
+    Return (candidate_id, midi), or None if the queue is empty.
+    """
+    if not state["prefetch_queue"]:
+        return None
+    candidate_id, genome, midi = state["prefetch_queue"].popleft()
+    state["last_genome"] = genome
+    state["last_candidate_id"] = candidate_id
+    return candidate_id, midi
+
+
 # =========================================================
 # Simple one-shot generator (no rating) for backend use
 # =========================================================
@@ -453,7 +605,9 @@ def generate_midi_file(
         num_mutations=num_mutations,
         mutation_prob=mutation_prob,
     )
-    generate_next_candidate(state, out_path=out_path, steps=num_steps)
+    # only the file is wanted, so skip rendering the in-memory bytes
+    child, _ = evolve_child(state)
+    _save_melody_to_midi(out_path, _candidate_melody(state, child, num_steps), bpm)
 
 
 if __name__ == "__main__":